@@ -1,24 +1,50 @@
 import os
 import time
-from urllib.parse import urlparse
-import requests
+import asyncio
+import logging
+from urllib.parse import urlparse, urlencode, quote_plus
 from typing import Optional
 
-import urllib
+import orjson
+import requests
 
 from consts import Consts
+from http_session import session, upload_session, DEFAULT_TIMEOUT
 from account_token_provider import get_arm_access_token, get_account_access_token
 
+logger = logging.getLogger(__name__)
+
+# Names longer than this are truncated before upload, by both upload_url() and file_upload()
+VIDEO_NAME_MAX_LENGTH = 80
+
 
 def get_file_name_no_extension(file_path):
     return os.path.splitext(os.path.basename(file_path))[0]
 
 
+def _strip_query(url):
+    # Video Indexer URLs carry an accessToken (and, for uploads, the blob SAS) in the query string,
+    # so it is dropped before a URL is logged or put into an exception message
+    return urlparse(url)._replace(query='', fragment='').geturl()
+
+
+def _raise_for_status(response):
+    '''
+    Same as `response.raise_for_status()`, but the URL in the error message has its query string removed.
+    The original error is not chained, so its message does not reach the host's exception log either.
+    '''
+    try:
+        response.raise_for_status()
+    except requests.HTTPError as e:
+        raise requests.HTTPError(str(e).replace(response.url, _strip_query(response.url)), response=response) from None
+
+
 class VideoIndexerClient:
     def __init__(self) -> None:
         self.arm_access_token = ''
         self.vi_access_token = ''
         self.account = None
+        self.videos_url = ''
         self.consts = None
 
     def authenticate(self, consts:Consts) -> None:
@@ -39,16 +65,18 @@ class VideoIndexerClient:
             'Content-Type': 'application/json'
         }
 
-        url = f'{self.consts.AzureResourceManager}/subscriptions/{self.consts.SubscriptionId}/resourcegroups/' + \
-              f'{self.consts.ResourceGroup}/providers/Microsoft.VideoIndexer/accounts/{self.consts.AccountName}' + \
-              f'?api-version={self.consts.ApiVersion}'
+        url = f'{self.consts.AccountResourceUrl}?api-version={self.consts.ApiVersion}'
 
-        response = requests.get(url, headers=headers)
+        response = session.get(url, headers=headers, timeout=DEFAULT_TIMEOUT)
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
-        self.account = response.json()
-        print(f'[Account Details] Id:{self.account["properties"]["accountId"]}, Location: {self.account["location"]}')
+        account = orjson.loads(response.content)
+        # The account location and id are fixed, so build the Videos base URL once. The client is shared by
+        # concurrent invocations, which treat a non-None account as fully set up, so assign the account last.
+        self.videos_url = f'{self.consts.ApiEndpoint}/{account["location"]}/Accounts/{account["properties"]["accountId"]}/Videos'
+        self.account = account
+        logger.info('[Account Details] Id:%s, Location: %s', account["properties"]["accountId"], account["location"])
 
     def upload_url(self, video_name:str, video_url:str, excluded_ai:Optional[list[str]]=None,
                          wait_for_index:bool=False, video_description:str='', privacy='private') -> str:
@@ -70,16 +98,15 @@ class VideoIndexerClient:
         # check that video_url is valid
         parsed_url = urlparse(video_url)
         if not parsed_url.scheme or not parsed_url.netloc:
-            raise Exception(f'Invalid video URL: {video_url}')
+            raise Exception(f'Invalid video URL: {_strip_query(video_url)}')
 
         self.get_account() # if account is not initialized, get it
 
-        base_url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/Videos'
+        base_url = self.videos_url
         
-        # Build params without videoUrl first
         params = {
             'accessToken': self.vi_access_token,
-            'name': video_name,
+            'name': video_name[:VIDEO_NAME_MAX_LENGTH],
             'description': video_description,
             'privacy': privacy,
         }
@@ -87,25 +114,28 @@ class VideoIndexerClient:
         if len(excluded_ai) > 0:
             params['excludedAI'] = ','.join(excluded_ai)
 
-        # Manually build the full URL to avoid double-encoding the SAS token
-        param_string = urllib.parse.urlencode(params)
-        # Append videoUrl separately with proper encoding
-        full_url = f'{base_url}?{param_string}&videoUrl={urllib.parse.quote(video_url, safe="")}'
+        params['videoUrl'] = video_url
+
+        # Encode the query string exactly once (the SAS token in videoUrl must not be double-encoded)
+        # and post the finished URL, so requests has nothing left to re-encode.
+        full_url = f'{base_url}?{urlencode(params, quote_via=quote_plus, safe="")}'
 
-        print(f'📤 POST request to: {base_url}')
-        print(f'📋 Video URL (first 100 chars): {video_url[:100]}...')
-        print(f'📋 Full request URL (first 200 chars): {full_url[:200]}...')
+        # videoUrl carries a SAS token and the query string an access token, so only the base URL is logged
+        logger.info('📤 POST request to: %s', base_url)
 
-        response = requests.post(full_url)
+        try:
+            response = upload_session.post(full_url, timeout=DEFAULT_TIMEOUT)
+        except requests.RequestException as e:
+            # Connection errors quote the request path and query, which hold the SAS and access token
+            raise type(e)(f'{type(e).__name__} posting to {base_url}') from None
         if response.status_code >= 400:
-            print(f'❌ Video Indexer Error: {response.status_code}')
-            print(f'❌ Response body: {response.text}')
-            print(f'❌ Request URL: {response.request.url[:200]}...')
+            logger.error('❌ Video Indexer Error: %s', response.status_code)
+            logger.error('❌ Response body: %s', response.text)
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
-        video_id = response.json().get('id')
-        print(f'Video ID {video_id} was uploaded successfully')
+        video_id = orjson.loads(response.content).get('id')
+        logger.info('Video ID %s was uploaded successfully', video_id)
 
         if wait_for_index:
             self.wait_for_index(video_id)
@@ -137,11 +167,11 @@ class VideoIndexerClient:
 
         self.get_account() # if account is not initialized, get it
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/Videos'
+        url = self.videos_url
 
         params = {
             'accessToken': self.vi_access_token,
-            'name': video_name[:80],  # TODO: Is there a limit on the video name? If so, notice the used and also update `upload_url()` accordingly
+            'name': video_name[:VIDEO_NAME_MAX_LENGTH],
             'description': video_description,
             'privacy': privacy,
             'partition': partition
@@ -150,20 +180,60 @@ class VideoIndexerClient:
         if len(excluded_ai) > 0:
             params['excludedAI'] = excluded_ai
 
-        print('Uploading a local file using multipart/form-data post request..')
+        logger.info('Uploading a local file using multipart/form-data post request..')
 
-        response = requests.post(url, params=params, files={'file': open(media_path,'rb')})
+        response = upload_session.post(url, params=params, files={'file': open(media_path,'rb')}, timeout=DEFAULT_TIMEOUT)
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
         if response.status_code != 200:
-            print(f'Request failed with status code: {response.StatusCode}')
+            logger.warning('Request failed with status code: %s', response.status_code)
 
-        video_id = response.json().get('id')
+        video_id = orjson.loads(response.content).get('id')
 
         return video_id
 
-    def wait_for_index(self, video_id:str, language:str='English', timeout_sec:Optional[int]=None) -> None:
+    def _poll_index(self, video_id:str, language:str) -> tuple[bool, Optional[dict]]:
+        '''
+        Calls getVideoIndex once and checks the indexing state; shared by `wait_for_index()` and
+        `wait_for_index_async()`. The access token is read from the token cache on every poll, so a long
+        wait is not left holding a token that expires part way through.
+
+        :param video_id: The video ID to check
+        :param language: The language to translate video insights
+        :return: (True, video index) when processed, (True, None) when failed, otherwise (False, None)
+        '''
+        self.authenticate(self.consts)
+
+        url = f'{self.videos_url}/{video_id}/Index'
+
+        params = {
+            'accessToken': self.vi_access_token,
+            'language': language
+        }
+
+        try:
+            response = session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+        except requests.RequestException as e:
+            raise type(e)(f'{type(e).__name__} getting {url}') from None
+
+        _raise_for_status(response)
+
+        video_result = orjson.loads(response.content)
+        video_state = video_result.get('state')
+
+        if video_state == 'Processed':
+            logger.info('The video index has completed for video ID %s.', video_id)
+            logger.debug('Full JSON of the index for video ID %s: \n%s', video_id, video_result)
+            return True, video_result
+        elif video_state == 'Failed':
+            logger.error("The video index failed for video ID %s.", video_id)
+            return True, None
+
+        logger.info('The video index state is %s', video_state)
+        return False, None
+
+    def wait_for_index(self, video_id:str, language:str='English', timeout_sec:Optional[int]=None) -> Optional[dict]:
         '''
         Calls getVideoIndex API in 10 second intervals until the indexing state is 'processed'
         (https://api-portal.videoindexer.ai/api-details#api=Operations&operation=Get-Video-Index).
@@ -172,58 +242,59 @@ class VideoIndexerClient:
         :param video_id: The video ID to wait for
         :param language: The language to translate video insights
         :param timeout_sec: The timeout in seconds
+        :return: The video index when it is processed, otherwise None
         '''
         self.get_account() # if account is not initialized, get it
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-            f'Videos/{video_id}/Index'
+        logger.info('Checking if video %s has finished indexing...', video_id)
+        start_time = time.time()
+        while True:
+            done, video_result = self._poll_index(video_id, language)
+            if done:
+                return video_result
 
-        params = {
-            'accessToken': self.vi_access_token,
-            'language': language
-        }
+            if timeout_sec is not None and time.time() - start_time > timeout_sec:
+                logger.warning('Timeout of %s seconds reached. Exiting...', timeout_sec)
+                return None
 
-        print(f'Checking if video {video_id} has finished indexing...')
-        processing = True
-        start_time = time.time()
-        while processing:
-            response = requests.get(url, params=params)
+            time.sleep(10) # wait 10 seconds before checking again
 
-            response.raise_for_status()
+    async def wait_for_index_async(self, video_id:str, language:str='English', timeout_sec:Optional[int]=None) -> Optional[dict]:
+        '''
+        Async version of `wait_for_index()`. Sleeps with asyncio between the 10 second polls, so no thread
+        is held while Video Indexer processes the video and many videos can be awaited on one worker.
 
-            video_result = response.json()
-            video_state = video_result.get('state')
+        :param video_id: The video ID to wait for
+        :param language: The language to translate video insights
+        :param timeout_sec: The timeout in seconds
+        :return: The video index when it is processed, otherwise None
+        '''
+        await asyncio.to_thread(self.get_account) # if account is not initialized, get it
 
-            if video_state == 'Processed':
-                processing = False
-                print(f'The video index has completed. Here is the full JSON of the index for video ID {video_id}: \n{video_result}')
+        logger.info('Checking if video %s has finished indexing...', video_id)
+        start_time = time.time()
+        while True:
+            done, video_result = await asyncio.to_thread(self._poll_index, video_id, language)
+            if done:
                 return video_result
-                break
-            elif video_state == 'Failed':
-                processing = False
-                print(f"The video index failed for video ID {video_id}.")
-                break
-
-            print(f'The video index state is {video_state}')
 
             if timeout_sec is not None and time.time() - start_time > timeout_sec:
-                print(f'Timeout of {timeout_sec} seconds reached. Exiting...')
-                break
+                logger.warning('Timeout of %s seconds reached. Exiting...', timeout_sec)
+                return None
 
-            time.sleep(10) # wait 10 seconds before checking again
+            await asyncio.sleep(10) # wait 10 seconds before checking again
 
     def is_video_processed(self, video_id:str) -> bool:
         self.get_account() # if account is not initialized, get it
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-                f'Videos/{video_id}/Index'
+        url = f'{self.videos_url}/{video_id}/Index'
         params = {
             'accessToken': self.vi_access_token,
         }
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+        response = session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+        _raise_for_status(response)
 
-        video_result = response.json()
+        video_result = orjson.loads(response.content)
         video_state = video_result.get('state')
 
         return video_state == 'Processed'
@@ -238,22 +309,21 @@ class VideoIndexerClient:
         '''
         self.get_account() # if account is not initialized, get it
 
-        print(f'Searching videos in account {self.account["properties"]["accountId"]} for video ID {video_id}.')
+        logger.info('Searching videos in account %s for video ID %s.', self.account["properties"]["accountId"], video_id)
 #https://api.videoindexer.ai/{location}/Accounts/{accountId}/Videos/{videoId}/Index[?language][&reTranslate][&includeStreamingUrls][&includedInsights][&excludedInsights][&includeSummarizedInsights][&accessToken]
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-               f'Videos/{video_id}/Index'
+        url = f'{self.videos_url}/{video_id}/Index'
 
         params = {
             'accessToken': self.vi_access_token
         }
 
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
-        search_result = response.json()
-        print(f'Here are the search results: \n{search_result}')
+        search_result = orjson.loads(response.content)
+        logger.debug('Here are the search results: \n%s', search_result)
         return search_result
 
     def generate_prompt_content(self, video_id:str) -> None:
@@ -266,8 +336,7 @@ class VideoIndexerClient:
         '''
         self.get_account() # if account is not initialized, get it
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-              f'Videos/{video_id}/PromptContent'
+        url = f'{self.videos_url}/{video_id}/PromptContent'
 
         headers = {
             "Content-Type": "application/json"
@@ -277,10 +346,10 @@ class VideoIndexerClient:
             'accessToken': self.vi_access_token
         }
 
-        response = requests.post(url, headers=headers, params=params)
+        response = session.post(url, headers=headers, params=params, timeout=DEFAULT_TIMEOUT)
 
-        response.raise_for_status()
-        print(f"Prompt content generation for {video_id=} started...")
+        _raise_for_status(response)
+        logger.info("Prompt content generation for video_id=%s started...", video_id)
 
     def fetch_prompt_content(self, video_id:str, raise_on_not_found:bool=True) -> Optional[dict]:
         '''
@@ -294,8 +363,7 @@ class VideoIndexerClient:
         '''
         self.get_account() # if account is not initialized, get it
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-              f'Videos/{video_id}/PromptContent'
+        url = f'{self.videos_url}/{video_id}/PromptContent'
 
         headers = {
             "Content-Type": "application/json"
@@ -305,13 +373,13 @@ class VideoIndexerClient:
             'accessToken': self.vi_access_token
         }
 
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
         if not raise_on_not_found and response.status_code == 404:
             return None
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
-        return response.json()
+        return orjson.loads(response.content)
 
     def get_prompt_content(self, video_id:str, timeout_sec:Optional[int]=None,
                            check_alreay_exists=True) -> Optional[dict]:
@@ -328,7 +396,7 @@ class VideoIndexerClient:
         if check_alreay_exists:
             prompt_content = self.fetch_prompt_content(video_id, raise_on_not_found=False)
             if prompt_content is not None:
-                print(f'Prompt content already exists for video ID {video_id}.')
+                logger.info('Prompt content already exists for video ID %s.', video_id)
                 return prompt_content
 
         self.generate_prompt_content(video_id)
@@ -339,10 +407,10 @@ class VideoIndexerClient:
             prompt_content = self.fetch_prompt_content(video_id, raise_on_not_found=False)
 
             if timeout_sec is not None and time.time() - start_time > timeout_sec:
-                print(f'Timeout of {timeout_sec} seconds reached. Exiting...')
+                logger.warning('Timeout of %s seconds reached. Exiting...', timeout_sec)
                 break
 
-            print('Prompt content is not ready yet. Waiting 5 seconds before checking again...')
+            logger.info('Prompt content is not ready yet. Waiting 5 seconds before checking again...')
             time.sleep(10)
 
         return prompt_content
@@ -365,7 +433,7 @@ class VideoIndexerClient:
                                                                   permission_type='Contributor', scope='Video',
                                                                   video_id=video_id)
 
-        print(f'Getting the insights widget URL for video {video_id}')
+        logger.info('Getting the insights widget URL for video %s', video_id)
 
         params = {
             'widgetType': widget_type,
@@ -373,15 +441,14 @@ class VideoIndexerClient:
             'accessToken': video_scope_access_token
         }
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-              f'Videos/{video_id}/InsightsWidget'
+        url = f'{self.videos_url}/{video_id}/InsightsWidget'
 
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
         insights_widget_url = response.url
-        print(f'Got the insights widget URL: {insights_widget_url}')
+        logger.info('Got the insights widget URL: %s', _strip_query(insights_widget_url))
 
     def get_player_widget_url(self, video_id:str) -> None:
         '''
@@ -399,18 +466,17 @@ class VideoIndexerClient:
                                                                   permission_type='Contributor', scope='Video',
                                                                   video_id=video_id)
 
-        print(f'Getting the player widget URL for video {video_id}')
+        logger.info('Getting the player widget URL for video %s', video_id)
 
         params = {
             'accessToken': video_scope_access_token
         }
 
-        url = f'{self.consts.ApiEndpoint}/{self.account["location"]}/Accounts/{self.account["properties"]["accountId"]}/' + \
-              f'Videos/{video_id}/PlayerWidget'
+        url = f'{self.videos_url}/{video_id}/PlayerWidget'
 
-        response = requests.get(url, params=params)
+        response = session.get(url, params=params, timeout=DEFAULT_TIMEOUT)
 
-        response.raise_for_status()
+        _raise_for_status(response)
 
         url = response.url
-        print(f'Got the player widget URL: {url}')
\ No newline at end of file
+        logger.info('Got the player widget URL: %s', _strip_query(url))
\ No newline at end of file
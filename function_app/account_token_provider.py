@@ -1,7 +1,36 @@
-import requests
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
 from azure.identity import DefaultAzureCredential
 
 import consts
+from http_session import session, DEFAULT_TIMEOUT
+
+# generateAccessToken returns no expiry; tokens are valid for one hour, so use a conservative TTL.
+_TOKEN_TTL_SECONDS = 50 * 60
+# Refresh ARM tokens this many seconds before their reported expiry.
+_ARM_TOKEN_REFRESH_SKEW_SECONDS = 5 * 60
+
+_token_lock = threading.Lock()
+_credential: Optional[DefaultAzureCredential] = None
+# {scope: (token, expires_on as a unix timestamp)}
+_arm_token_cache: Dict[str, Tuple[str, float]] = {}
+# {(account name, permission type, scope, video id): (token, time.monotonic() deadline)}
+_vi_token_cache: Dict[Tuple[str, str, str, Optional[str]], Tuple[str, float]] = {}
+
+
+def get_credential() -> DefaultAzureCredential:
+    '''
+    Get the process-wide credential, created on first use and shared with the function app's clients
+    (uses the user-assigned managed identity in Azure, developer credentials locally)
+    '''
+    global _credential
+
+    if _credential is None:
+        _credential = DefaultAzureCredential(managed_identity_client_id=os.environ.get("MANAGED_IDENTITY_CLIENT_ID"))
+    return _credential
 
 
 def get_arm_access_token(consts:consts.Consts) -> str:
@@ -12,16 +41,28 @@ def get_arm_access_token(consts:consts.Consts) -> str:
     :param consts: Consts object
     :return: Access token for the Azure Resource Manager
     '''
-    credential = DefaultAzureCredential()
     scope = f"{consts.AzureResourceManager}/.default" 
-    token = credential.get_token(scope)
-    return token.token
+
+    # Most calls find a fresh token; only take the lock to refresh, so a slow refresh does not block them
+    cached = _arm_token_cache.get(scope)
+    if cached and cached[1] - _ARM_TOKEN_REFRESH_SKEW_SECONDS > time.time():
+        return cached[0]
+
+    with _token_lock:
+        # Another thread may have refreshed the token while this one waited for the lock
+        cached = _arm_token_cache.get(scope)
+        if cached and cached[1] - _ARM_TOKEN_REFRESH_SKEW_SECONDS > time.time():
+            return cached[0]
+
+        token = get_credential().get_token(scope)
+        _arm_token_cache[scope] = (token.token, token.expires_on)
+        return token.token
 
 
 def get_account_access_token(consts, arm_access_token, permission_type='Contributor', scope='Account',
                                    video_id=None):
     '''
-    Get an access token for the Video Indexer account
+    Get an access token for the Video Indexer account, reusing a cached one for the same permission and scope
     
     :param consts: Consts object
     :param arm_access_token: Access token for the Azure Resource Manager
@@ -30,15 +71,32 @@ def get_account_access_token(consts, arm_access_token, permission_type='Contribu
     :param video_id: Video ID for the access token, if scope is Video. Otherwise, not required
     :return: Access token for the Video Indexer account
     '''
+    key = (consts.AccountName, permission_type, scope, video_id)
+
+    cached = _vi_token_cache.get(key)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    with _token_lock:
+        cached = _vi_token_cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        access_token = _request_account_access_token(consts, arm_access_token, permission_type, scope, video_id)
+        _vi_token_cache[key] = (access_token, time.monotonic() + _TOKEN_TTL_SECONDS)
+        return access_token
+
+
+def _request_account_access_token(consts, arm_access_token, permission_type, scope, video_id) -> str:
+    '''
+    Call the ARM generateAccessToken endpoint for the Video Indexer account
+    '''
 
     headers = {
         'Authorization': 'Bearer ' + arm_access_token,
         'Content-Type': 'application/json'
     }
 
-    url = f'{consts.AzureResourceManager}/subscriptions/{consts.SubscriptionId}/resourceGroups/{consts.ResourceGroup}' + \
-          f'/providers/Microsoft.VideoIndexer/accounts/{consts.AccountName}/generateAccessToken?api-version={consts.ApiVersion}'
-
     params = {
         'permissionType': permission_type,
         'scope': scope
@@ -47,7 +105,7 @@ def get_account_access_token(consts, arm_access_token, permission_type='Contribu
     if video_id is not None:
         params['videoId'] = video_id
 
-    response = requests.post(url, json=params, headers=headers)
+    response = session.post(consts.AccessTokenUrl, json=params, headers=headers, timeout=DEFAULT_TIMEOUT)
     
     # check if the response is valid
     response.raise_for_status()
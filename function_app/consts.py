@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -9,9 +9,16 @@ class Consts:
     AccountName: str
     ResourceGroup: str
     SubscriptionId: str
+    # Derived from the fields above in __post_init__; they never change for the lifetime of the process
+    AccountResourceUrl: str = field(init=False)
+    AccessTokenUrl: str = field(init=False)
 
     def __post_init__(self):
         if self.AccountName is None or self.AccountName == '' \
             or self.ResourceGroup is None or self.ResourceGroup == '' \
             or self.SubscriptionId is None or self.SubscriptionId == '':
-            raise ValueError('Please Fill In SubscriptionId, Account Name and Resource Group on the Constant Class!')
\ No newline at end of file
+            raise ValueError('Please Fill In SubscriptionId, Account Name and Resource Group on the Constant Class!')
+
+        self.AccountResourceUrl = f'{self.AzureResourceManager}/subscriptions/{self.SubscriptionId}/resourceGroups/' + \
+                                  f'{self.ResourceGroup}/providers/Microsoft.VideoIndexer/accounts/{self.AccountName}'
+        self.AccessTokenUrl = f'{self.AccountResourceUrl}/generateAccessToken?api-version={self.ApiVersion}'
@@ -1,4 +1,7 @@
-from azure.search.documents.indexes import SearchIndexClient
+import asyncio
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.search.documents.indexes.aio import SearchIndexClient
 from azure.search.documents.indexes.models import (
     SearchIndex,
     SimpleField,
@@ -7,14 +10,43 @@ from azure.search.documents.indexes.models import (
     ComplexField
 )
 
-def create_video_search_index(search_endpoint, index_name, credential):
-        # NOTE: The fields 'keywords', 'topics', 'faces', and 'labels' are defined as simple strings (not collections)
-        # to match the actual deployed Azure Search index schema. This is due to a previous issue where these fields
-        # were incorrectly defined as arrays, causing upload errors. See troubleshooting notes in the project history.
-        # If you wish to use arrays for these fields, you must update both the index and the function app mapping logic.
-    """Create a search index for video insights."""
-    index_client = SearchIndexClient(endpoint=search_endpoint, credential=credential)
-    
+# Indexes whose schema this worker has already verified or applied, keyed by index name
+_INDEX_APPLIED = {}
+_index_lock = asyncio.Lock()
+
+
+def _field_signature(field):
+    """Reduce a field to the attributes we define, so a local and a deployed schema can be compared."""
+    return (
+        field.name,
+        field.type,
+        bool(field.key),
+        bool(field.searchable),
+        bool(field.filterable),
+        bool(field.facetable),
+        bool(field.sortable),
+        bool(field.hidden),
+        tuple(_field_signature(sub_field) for sub_field in field.fields or ()),
+    )
+
+async def create_video_search_index(search_endpoint, index_name, credential):
+    """Create a search index for video insights, skipping the update when the schema is already deployed."""
+    if index_name in _INDEX_APPLIED:
+        return _INDEX_APPLIED[index_name]
+
+    async with _index_lock:
+        if index_name in _INDEX_APPLIED:
+            return _INDEX_APPLIED[index_name]
+
+        async with SearchIndexClient(endpoint=search_endpoint, credential=credential) as index_client:
+            index = await _apply_video_search_index(index_client, index_name)
+
+        _INDEX_APPLIED[index_name] = index
+        return index
+
+
+async def _apply_video_search_index(index_client, index_name):
+    """Compare the deployed index with the video insights schema and create or update it if they differ."""
     fields = [
         SimpleField(name="id", type=SearchFieldDataType.String, key=True),
         SimpleField(name="videoId", type=SearchFieldDataType.String, filterable=True),
@@ -24,17 +56,21 @@ def create_video_search_index(search_endpoint, index_name, credential):
             name="transcriptEntries",
             collection=True,
             fields=[
-                SearchableField(name="text", type=SearchFieldDataType.String),
+                # Full-text search runs against the top-level "transcript" field, which holds the same text;
+                # the per-entry copy is only returned for timestamps, so it gets no inverted index.
+                SimpleField(name="text", type=SearchFieldDataType.String),
                 SimpleField(name="startSeconds", type=SearchFieldDataType.Double, filterable=True),
                 SimpleField(name="endSeconds", type=SearchFieldDataType.Double, filterable=True),
                 SimpleField(name="speakerId", type=SearchFieldDataType.Int32, filterable=True),
-                SimpleField(name="confidence", type=SearchFieldDataType.Double, filterable=True),
+                SimpleField(name="confidence", type=SearchFieldDataType.Double),
             ],
         ),
-        SearchableField(name="keywords", type=SearchFieldDataType.String, filterable=True, facetable=True),
-        SearchableField(name="topics", type=SearchFieldDataType.String, filterable=True, facetable=True),
-        SearchableField(name="faces", type=SearchFieldDataType.String, filterable=True),
-        SearchableField(name="labels", type=SearchFieldDataType.String, filterable=True, facetable=True),
+        # keywords, topics, faces and labels are term collections so $filter and facets match whole values.
+        # build_search_document in function_app.py emits each of them as a list of names.
+        SearchableField(name="keywords", type=SearchFieldDataType.String, collection=True, filterable=True, facetable=True),
+        SearchableField(name="topics", type=SearchFieldDataType.String, collection=True, filterable=True, facetable=True),
+        SearchableField(name="faces", type=SearchFieldDataType.String, collection=True, filterable=True),
+        SearchableField(name="labels", type=SearchFieldDataType.String, collection=True, filterable=True, facetable=True),
         SearchableField(name="ocr", type=SearchFieldDataType.String),
         SimpleField(name="duration", type=SearchFieldDataType.Double, filterable=True, sortable=True),
         SimpleField(name="created", type=SearchFieldDataType.DateTimeOffset, filterable=True, sortable=True),
@@ -45,6 +81,19 @@ def create_video_search_index(search_endpoint, index_name, credential):
         SimpleField(name="indexedAt", type=SearchFieldDataType.DateTimeOffset, filterable=True, sortable=True),
     ]
     
+    try:
+        existing = await index_client.get_index(index_name)
+    except ResourceNotFoundError:
+        existing = None
+
+    if existing is not None and \
+            [_field_signature(f) for f in existing.fields] == [_field_signature(f) for f in fields]:
+        return existing
+
     index = SearchIndex(name=index_name, fields=fields)
-    index_client.create_or_update_index(index)
-    return index
\ No newline at end of file
+    try:
+        await index_client.create_or_update_index(index)
+    except ResourceExistsError:
+        # Another worker created the index between our get_index and this call
+        pass
+    return index
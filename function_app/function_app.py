@@ -1,20 +1,30 @@
 import os
+import re
+import asyncio
+import atexit
+import functools
+import queue
+import threading
+import time
 import logging
 import json
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from urllib.parse import unquote
-from typing import Any, Dict, List, Optional
+from urllib.parse import quote, unquote, urlparse
+from typing import Any, Dict, List, Optional, Tuple
 
 import azure.functions as func
-import requests
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+from azure.functions.warmup import WarmUpContext
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+from azure.storage.blob import generate_blob_sas, BlobSasPermissions, UserDelegationKey
+from azure.storage.blob.aio import BlobServiceClient
+from azure.core.pipeline.policies import RetryPolicy
 from azure.search.documents import SearchClient
-from pprint import pprint
 from VideoIndexerClient import VideoIndexerClient
 from consts import Consts
 from create_index import create_video_search_index
+from account_token_provider import get_credential
 
 app = func.FunctionApp()
 
@@ -30,10 +40,27 @@ FUNCTION_APP_URL = os.environ.get("FUNCTION_APP_URL")
 AZURE_VIDEO_INDEXER_ACCOUNT_NAME = os.environ.get("AZURE_VIDEO_INDEXER_ACCOUNT_NAME")
 AZURE_SUBSCRIPTION_ID = os.environ.get("AZURE_SUBSCRIPTION_ID")
 AZURE_RESOURCE_GROUP = os.environ.get("AZURE_RESOURCE_GROUP")
+# Set to 1 where the index is provisioned out of band, so workers never check or apply the schema
+SKIP_INDEX_CREATE = os.environ.get("SKIP_INDEX_CREATE", "0") == "1"
 
 # Constants
 CONTAINER_NAME = "dr-videos"
-VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".wmv", ".mkv", ".webm", ".flv"}
+# A tuple so it can be passed straight to str.endswith()
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".wmv", ".mkv", ".webm", ".flv")
+VIDEO_QUEUE_NAME = "dr-videos-ingest"
+# Submitted video IDs, so waiting for the index and the search upload can be retried without resubmitting
+INDEXED_QUEUE_NAME = "dr-videos-indexed"
+SAS_LIFETIME = timedelta(hours=2)
+USER_DELEGATION_KEY_LIFETIME = timedelta(hours=6)
+# Refresh the key while it still outlives a full SAS, so a SAS is never cut short by the key's expiry
+USER_DELEGATION_KEY_REFRESH_MARGIN = SAS_LIFETIME + timedelta(minutes=15)
+SEARCH_BATCH_SIZE = 500
+SEARCH_BATCH_WINDOW_SECONDS = 2.0
+# A 207 response reports these per-document statuses for transient failures (throttling, version conflicts)
+SEARCH_DOCUMENT_RETRIES = 3
+_RETRYABLE_DOCUMENT_STATUS = (409, 422, 503)
+# Video Indexer timestamps: [[hh:]mm:]ss[.fffffff]
+_TIMESTAMP_RE = re.compile(r"^(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)$")
 
 # Azure Video Indexer API endpoints
 #VIDEO_INDEXER_API_URL = "https://api.videoindexer.ai"
@@ -43,8 +70,42 @@ VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".wmv", ".mkv", ".webm", ".flv"}
 #    "generateAccessToken?api-version=2024-01-01"
 #)
 
-# Shared credential instance (supports Managed Identity in Azure, developer creds locally)
-_credential = DefaultAzureCredential(managed_identity_client_id=MANAGED_IDENTITY_CLIENT_ID)
+# Shared clients are created on first use rather than at import, so each worker process
+# (FUNCTIONS_WORKER_PROCESS_COUNT > 1) starts without them and builds its own on its first invocation
+# (or in warmup, where the plan supports it). The sync credential comes from account_token_provider.get_credential.
+
+@functools.lru_cache(maxsize=1)
+def _get_async_credential() -> AsyncDefaultAzureCredential:
+    """Async counterpart for the aio SDK clients, so their I/O yields to the event loop."""
+    return AsyncDefaultAzureCredential(managed_identity_client_id=MANAGED_IDENTITY_CLIENT_ID)
+
+@functools.lru_cache(maxsize=1)
+def _get_blob_service_client() -> BlobServiceClient:
+    """Shared blob client; it owns the HTTP pipeline/connection pool, so build it once per worker."""
+    return BlobServiceClient(
+        account_url=f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
+        credential=_get_async_credential()
+    )
+
+# PYTHON_THREADPOOL_THREAD_COUNT only sizes the host's pool for sync functions. The async handlers run their
+# blocking Video Indexer calls through asyncio.to_thread, which uses the event loop's default executor, so that
+# executor is given the same size.
+THREAD_POOL_SIZE = int(os.environ.get("PYTHON_THREADPOOL_THREAD_COUNT", "32"))
+_sized_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _ensure_default_executor() -> None:
+    """Give the running event loop a default executor of THREAD_POOL_SIZE threads (once per loop)."""
+    global _sized_loop
+
+    loop = asyncio.get_running_loop()
+    if _sized_loop is loop:
+        return
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix="blocking-io"))
+    _sized_loop = loop
+
+# Cached user delegation key and its expiry, so SAS generation is local work on most invocations
+_udk_cache: Optional[Tuple[UserDelegationKey, datetime]] = None
+_udk_lock = asyncio.Lock()
 
 # Create Consts instance for Video Indexer client
 consts_config = Consts(
@@ -56,26 +117,51 @@ consts_config = Consts(
     SubscriptionId=AZURE_SUBSCRIPTION_ID
 )
 
+# Shared Video Indexer client; caches the account details across invocations
+_video_indexer_client = VideoIndexerClient()
+
 logger = logging.getLogger(__name__)
 
 logger.info("Azure Search Endpoint: %s", AZURE_SEARCH_ENDPOINT)
 logger.info("Azure Search Index Name: %s", AZURE_SEARCH_INDEX_NAME)
 
-create_video_search_index(AZURE_SEARCH_ENDPOINT, AZURE_SEARCH_INDEX_NAME, _credential)
+async def _ensure_search_index() -> None:
+    """Create or update the search index once per worker (awaited from the first invocation)."""
+    if SKIP_INDEX_CREATE or not AZURE_SEARCH_ENDPOINT or not AZURE_SEARCH_INDEX_NAME:
+        return
+    await create_video_search_index(AZURE_SEARCH_ENDPOINT, AZURE_SEARCH_INDEX_NAME, _get_async_credential())
 
-def get_blob_sas_url(blob_name: str) -> str:
+async def _get_user_delegation_key(now: datetime) -> Tuple[UserDelegationKey, datetime]:
+    """Return the cached user delegation key, requesting a new one when it is close to expiry."""
+    global _udk_cache
+
+    cached = _udk_cache
+    if cached and now < cached[1] - USER_DELEGATION_KEY_REFRESH_MARGIN:
+        return cached
+
+    async with _udk_lock:
+        # Another invocation may have refreshed the key while this one waited for the lock
+        if _udk_cache and now < _udk_cache[1] - USER_DELEGATION_KEY_REFRESH_MARGIN:
+            return _udk_cache
+
+        skew = timedelta(minutes=5)
+        key_expiry = now + USER_DELEGATION_KEY_LIFETIME
+        user_delegation_key = await _get_blob_service_client().get_user_delegation_key(
+            key_start_time=now - skew,
+            key_expiry_time=key_expiry,
+        )
+        _udk_cache = (user_delegation_key, key_expiry)
+        return _udk_cache
+
+async def get_blob_sas_url(blob_name: str) -> str:
     """Generate a SAS URL for the blob to be used by Video Indexer."""
-    logger.info(f"🔧 Generating SAS URL for blob: {blob_name}")
+    logger.info("🔧 Generating SAS URL for blob: %s", blob_name)
 
-    account_url = f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net"
-    blob_service_client = BlobServiceClient(account_url=account_url, credential=_credential)
+    account_url = _get_blob_service_client().url.rstrip("/")
 
     now = datetime.now(timezone.utc)
     skew = timedelta(minutes=5)
-    user_delegation_key = blob_service_client.get_user_delegation_key(
-        key_start_time=now - skew,
-        key_expiry_time=now + timedelta(hours=2),
-    )
+    user_delegation_key, key_expiry = await _get_user_delegation_key(now)
 
     sas_token = generate_blob_sas(
         account_name=STORAGE_ACCOUNT_NAME,
@@ -83,91 +169,75 @@ def get_blob_sas_url(blob_name: str) -> str:
         blob_name=blob_name,
         user_delegation_key=user_delegation_key,
         permission=BlobSasPermissions(read=True),
-        expiry=now + timedelta(hours=2),
+        # A SAS cannot outlive the delegation key that signed it
+        expiry=min(now + SAS_LIFETIME, key_expiry),
         start=now - skew,
         version=BLOB_SAS_VERSION,
     )
 
-    logger.info("🎉 Generated SAS URL for blob successfully.")
-    logger.info(f"🔍 SAS URL: {account_url}/{CONTAINER_NAME}/{blob_name}?{sas_token}")
-    return f"{account_url}/{CONTAINER_NAME}/{blob_name}?{sas_token}"
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("SAS URL generated for %s", blob_name)
+    # The SAS is signed for the raw name, but the URL path must be percent-encoded so names with spaces,
+    # '#', '%' or '?' still reach the blob with the whole query string attached
+    return f"{account_url}/{CONTAINER_NAME}/{quote(blob_name)}?{sas_token}"
 
+@functools.lru_cache(maxsize=4096)
 def _time_to_seconds(value: Optional[str]) -> Optional[float]:
     """Convert a hh:mm:ss.f time string to seconds (float)."""
     if value is None:
         return None
-    try:
-        parts = str(value).split(":")
-        parts = [float(p) for p in parts]
-        while len(parts) < 3:
-            parts.insert(0, 0.0)
-        hours, minutes, seconds = parts[-3], parts[-2], parts[-1]
-        return hours * 3600 + minutes * 60 + seconds
-    except Exception:
+    match = _TIMESTAMP_RE.match(str(value))
+    if match is None:
         return None
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds)
     
-def _extract_transcript_entries(index_json: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Extract transcript entries with timestamps and speaker info."""
+def _extract_transcript_entries(video_insights: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Extract transcript entries with timestamps and speaker info, plus their texts in order (one pass)."""
     transcripts: List[Dict[str, Any]] = []
+    texts: List[str] = []
     
-    # Get transcript from videos[0].insights
-    videos = index_json.get("videos") or []
-    if videos and videos[0].get("insights"):
-        transcript_data = videos[0]["insights"].get("transcript", [])
+    for entry in video_insights.get("transcript", []):
+        if not (text := entry.get("text")):
+            continue
         
-        for entry in transcript_data:
-            text = entry.get("text")
-            if not text:
-                continue
-            
-            instances = entry.get("instances") or []
-            start = end = None
-            if instances:
-                start = instances[0].get("start") or instances[0].get("adjustedStart")
-                end = instances[0].get("end") or instances[0].get("adjustedEnd")
-            
-            # Build entry, only including fields with valid values
-            transcript_entry = {"text": text}
-            
-            start_seconds = _time_to_seconds(start)
-            if start_seconds is not None:
-                transcript_entry["startSeconds"] = start_seconds
-            
-            end_seconds = _time_to_seconds(end)
-            if end_seconds is not None:
-                transcript_entry["endSeconds"] = end_seconds
-            
-            speaker_id = entry.get("speakerId")
-            if speaker_id is not None:
-                transcript_entry["speakerId"] = speaker_id
-            
-            confidence = entry.get("confidence")
-            if confidence is not None:
-                transcript_entry["confidence"] = confidence
-            
-            transcripts.append(transcript_entry)
-    
-    return transcripts
+        instances = entry.get("instances")
+        first_instance = instances[0] if instances else {}
+        start = first_instance.get("start") or first_instance.get("adjustedStart")
+        end = first_instance.get("end") or first_instance.get("adjustedEnd")
+        
+        # Build entry, only including fields with valid values
+        transcript_entry = {
+            key: value for key, value in (
+                ("text", text),
+                ("startSeconds", _time_to_seconds(start)),
+                ("endSeconds", _time_to_seconds(end)),
+                ("speakerId", entry.get("speakerId")),
+                ("confidence", entry.get("confidence")),
+            ) if value is not None
+        }
+        
+        transcripts.append(transcript_entry)
+        texts.append(text)
+
+    return transcripts, texts
 
 def _collect_names(items: List[Dict[str, Any]], name_field: str = "name") -> List[str]:
     """Extract names from a list of items."""
-    names: List[str] = []
-    for item in items or []:
-        name = item.get(name_field)
-        if name:
-            names.append(name)
-    return names
+    return [name for item in items or () if (name := item.get(name_field))]
 
 def build_search_document(index_json: Dict[str, Any]) -> Dict[str, Any]:
     """Map Video Indexer insights JSON into the Azure AI Search document shape."""
     video_id = index_json.get("id")
-    videos = index_json.get("videos", [])
-    video_insights = videos[0].get("insights", {}) if videos else {}
+    # Bind the nested dicts once; everything below reads from these locals
+    videos = index_json.get("videos") or []
+    vi0 = videos[0] if videos else {}
+    video_insights = vi0.get("insights") or {}
     summarized = index_json.get("summarizedInsights", {})
     
     # Extract transcript entries
-    transcript_entries = _extract_transcript_entries(index_json)
-    transcript_text = " ".join([t.get("text", "") for t in transcript_entries]).strip() or None
+    transcript_entries, transcript_texts = _extract_transcript_entries(video_insights)
+    transcript_text = " ".join(transcript_texts).strip() or None
     
     # Extract keywords, topics, faces, labels
     keywords = _collect_names(summarized.get("keywords", []))
@@ -177,8 +247,7 @@ def build_search_document(index_json: Dict[str, Any]) -> Dict[str, Any]:
     
     # Extract OCR text
     ocr_entries = video_insights.get("ocr", [])
-    ocr_texts = [entry.get("text") for entry in ocr_entries if entry.get("text")]
-    ocr_text = " ".join(ocr_texts) if ocr_texts else None
+    ocr_text = " ".join(text for entry in ocr_entries if (text := entry.get("text"))) or None
     
     # Get duration
     duration = index_json.get("durationInSeconds") or summarized.get("duration", {}).get("seconds")
@@ -191,21 +260,21 @@ def build_search_document(index_json: Dict[str, Any]) -> Dict[str, Any]:
     language = video_insights.get("language") or video_insights.get("sourceLanguage")
     
     # Get published URL and thumbnail
-    published_url = videos[0].get("publishedUrl") if videos else None
-    thumbnail_id = videos[0].get("thumbnailId") if videos else None
+    published_url = vi0.get("publishedUrl")
+    thumbnail_id = vi0.get("thumbnailId")
     
     # Build the document - match the ACTUAL Azure Search index schema
-    # Note: transcriptEntries is Collection(ComplexType), others are Edm.String
+    # Note: transcriptEntries is Collection(ComplexType); keywords, topics, faces and labels are Collection(Edm.String)
     document = {
         "id": video_id,
         "videoId": video_id,
         "name": index_json.get("name"),
         "transcript": transcript_text,
         "transcriptEntries": transcript_entries,  # Keep as array - schema expects Collection(ComplexType)
-        "keywords": ", ".join(keywords) if keywords else "",  # Convert to string - schema expects Edm.String
-        "topics": ", ".join(topics) if topics else "",  # Convert to string - schema expects Edm.String
-        "faces": ", ".join(faces) if faces else "",  # Convert to string - schema expects Edm.String
-        "labels": ", ".join(labels) if labels else "",  # Convert to string - schema expects Edm.String
+        "keywords": keywords,
+        "topics": topics,
+        "faces": faces,
+        "labels": labels,
         "ocr": ocr_text,
         "duration": duration,
         "created": index_json.get("created"),
@@ -219,8 +288,140 @@ def build_search_document(index_json: Dict[str, Any]) -> Dict[str, Any]:
     return document
 
 
-def upload_to_search_index(index_json: Dict[str, Any]) -> bool:
-    """Upload video insights to Azure AI Search."""
+def _resolve_futures(futures: List["Future[None]"], exception: Optional[BaseException] = None) -> None:
+    """Complete the futures waiting on one document, skipping any that are already done."""
+    for future in futures:
+        if future.done():
+            continue
+        if exception is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exception)
+
+
+def _upload_search_batch(batch: List[Tuple[Dict[str, Any], "Future[None]"]]) -> None:
+    """Send one batch of documents to the search index and resolve each document's future with its result."""
+    # Documents whose invocation was cancelled while queued are dropped; the rest can no longer be cancelled.
+    # A video queued twice is sent once (the latest document wins) and all of its waiters get that result.
+    pending: Dict[Any, Tuple[Dict[str, Any], List["Future[None]"]]] = {}
+    for document, future in batch:
+        if not future.set_running_or_notify_cancel():
+            continue
+        futures = pending[document["id"]][1] if document["id"] in pending else []
+        futures.append(future)
+        pending[document["id"]] = (document, futures)
+
+    for attempt in range(SEARCH_DOCUMENT_RETRIES + 1):
+        if not pending:
+            return
+        try:
+            results = _get_search_client().upload_documents(documents=[document for document, _ in pending.values()])
+        except Exception as e:
+            logger.exception("❌ Error uploading %s documents to search index: %s", len(pending), e)
+            for _, futures in pending.values():
+                _resolve_futures(futures, e)
+            return
+
+        retry: Dict[Any, Tuple[Dict[str, Any], List["Future[None]"]]] = {}
+        for result in results:
+            entry = pending.pop(result.key, None)
+            if entry is None:
+                continue
+            if result.succeeded:
+                logger.info("✅ Successfully uploaded video %s to search index", result.key)
+                _resolve_futures(entry[1])
+            elif result.status_code in _RETRYABLE_DOCUMENT_STATUS and attempt < SEARCH_DOCUMENT_RETRIES:
+                logger.warning("⚠️ Search returned %s for video %s; retrying", result.status_code, result.key)
+                retry[result.key] = entry
+            else:
+                logger.error("❌ Failed to upload video %s: %s", result.key, result.error_message)
+                _resolve_futures(entry[1], RuntimeError(f"Search upload failed for video {result.key}: {result.error_message}"))
+
+        for key, (_, futures) in pending.items():
+            _resolve_futures(futures, RuntimeError(f"Search upload returned no result for video {key}"))
+
+        pending = retry
+        if pending:
+            time.sleep(2 ** attempt)
+
+
+def _search_upload_worker() -> None:
+    """Drain the search queue forever, uploading up to SEARCH_BATCH_SIZE documents per request."""
+    while True:
+        batch = [_search_queue.get()]
+        deadline = time.monotonic() + SEARCH_BATCH_WINDOW_SECONDS
+        while len(batch) < SEARCH_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_search_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # This is the only uploader thread, so one bad batch must not end it
+        try:
+            _upload_search_batch(batch)
+        except Exception as e:
+            logger.exception("❌ Search upload worker failed on a batch of %s documents: %s", len(batch), e)
+            _resolve_futures([future for _, future in batch], e)
+
+
+def _flush_search_queue() -> None:
+    """Upload whatever is still queued; registered with atexit so a clean shutdown does not strand documents."""
+    batch: List[Tuple[Dict[str, Any], "Future[None]"]] = []
+    while True:
+        try:
+            batch.append(_search_queue.get_nowait())
+        except queue.Empty:
+            break
+        if len(batch) == SEARCH_BATCH_SIZE:
+            _upload_search_batch(batch)
+            batch = []
+    if batch:
+        _upload_search_batch(batch)
+
+
+# Documents from every concurrent invocation go onto one queue; a single background thread batches them
+# into upload_documents calls, so a burst of videos costs about one search request per batch window.
+# Each document carries a future that the invocation awaits, so the queue message only completes once the
+# document is in the index, and a failed upload fails the invocation and is retried.
+_search_queue: "queue.Queue[Tuple[Dict[str, Any], Future[None]]]" = queue.Queue()
+_search_uploader_lock = threading.Lock()
+_search_uploader_started = False
+
+
+@functools.lru_cache(maxsize=1)
+def _get_search_client() -> SearchClient:
+    """Shared search client used by the background uploader."""
+    return SearchClient(
+        endpoint=AZURE_SEARCH_ENDPOINT,
+        index_name=AZURE_SEARCH_INDEX_NAME,
+        credential=get_credential(),
+        # Search throttles bursts with 503 (or 429 with Retry-After). The default policy gives up after 3 status
+        # retries; allow more, with a longer backoff, before the whole batch fails.
+        retry_policy=RetryPolicy(retry_status=8, retry_backoff_factor=1.0),
+    )
+
+
+def _ensure_search_uploader() -> None:
+    """Start the background uploader thread (once per worker process) on the first queued document."""
+    global _search_uploader_started
+
+    with _search_uploader_lock:
+        if _search_uploader_started:
+            return
+        threading.Thread(target=_search_upload_worker, name="search-upload", daemon=True).start()
+        atexit.register(_flush_search_queue)
+        _search_uploader_started = True
+
+
+async def upload_to_search_index(index_json: Dict[str, Any]) -> bool:
+    """
+    Upload video insights to Azure AI Search through the background uploader.
+
+    Returns False if search is not configured or the document could not be built; raises if the upload
+    itself fails, so the queue message is retried.
+    """
     if not AZURE_SEARCH_ENDPOINT or not AZURE_SEARCH_INDEX_NAME:
         logger.warning("⚠️ Azure Search not configured - skipping upload")
         return False
@@ -229,97 +430,130 @@ def upload_to_search_index(index_json: Dict[str, Any]) -> bool:
         # Build the search document
         document = build_search_document(index_json)
         video_id = document["id"]
-        
-        logger.info(f"📄 Building search document for video {video_id}")
-        
-        # Create search client and upload
-        search_client = SearchClient(
-            endpoint=AZURE_SEARCH_ENDPOINT,
-            index_name=AZURE_SEARCH_INDEX_NAME,
-            credential=_credential
-        )
-        
-        result = search_client.upload_documents(documents=[document])
-        
-        # Check if upload succeeded
-        if result and result[0].succeeded:
-            logger.info(f"✅ Successfully uploaded video {video_id} to search index")
-            return True
-        else:
-            error_msg = result[0].error_message if result else "Unknown error"
-            logger.error(f"❌ Failed to upload video {video_id}: {error_msg}")
-            return False
-            
     except Exception as e:
-        logger.exception(f"❌ Error uploading to search index: {e}")
+        logger.exception("❌ Error building search document: %s", e)
         return False
 
+    logger.info("📄 Building search document for video %s", video_id)
+
+    # Hand the document to the background uploader; it is sent with other pending documents and the
+    # future is resolved by _upload_search_batch with this document's result
+    future: "Future[None]" = Future()
+    _ensure_search_uploader()
+    _search_queue.put((document, future))
+    logger.info("✅ Queued video %s for upload to search index", video_id)
+    await asyncio.wrap_future(future)
+    return True
+
+
+def _get_video_indexer_client() -> VideoIndexerClient:
+    """Return the shared Video Indexer client with fresh ARM/account tokens and account details loaded."""
+    # Get access tokens (arm and Video Indexer account); these come from the in-process token cache,
+    # so every message in a batch shares the same tokens and the account lookup is only done once.
+    _video_indexer_client.authenticate(consts_config)
+    _video_indexer_client.get_account()
+    return _video_indexer_client
+
+
+async def _prefetch_udk() -> None:
+    """Populate the user delegation key cache."""
+    await _get_user_delegation_key(datetime.now(timezone.utc))
+
+
+# Only fires on plans with pre-warmed instances (Premium/Flex); elsewhere the first invocation fills the caches.
+@app.warm_up_trigger(arg_name="warmupContext")
+async def warmup(warmupContext: WarmUpContext) -> None:
+    """Fill the token, delegation key and index caches before the instance receives its first video."""
+    _ensure_default_executor()
+    results = await asyncio.gather(
+        asyncio.to_thread(_get_video_indexer_client),
+        _prefetch_udk(),
+        _ensure_search_index(),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("⚠️ Warm-up step failed; it will be retried on first use: %s", result)
+
 
-@app.blob_trigger(arg_name="blob", path=f"{CONTAINER_NAME}/{{blobname}}", connection="AzureWebJobsStorage")
-def process_video_blob(blob: func.InputStream):
-    """Trigger when a new blob is uploaded; send video to Video Indexer."""
-    logger.info("🚀 Blob trigger function processed blob!")
-    logger.info(f"Name: {blob.name}")
-    logger.info(f"Size: {blob.length} bytes")
+@app.event_grid_trigger(arg_name="event")
+@app.queue_output(arg_name="msg", queue_name=VIDEO_QUEUE_NAME, connection="AzureWebJobsStorage")
+def process_video_blob(event: func.EventGridEvent, msg: func.Out[str]):
+    """Trigger on a Microsoft.Storage.BlobCreated event; queue the video for indexing."""
+    # Only the blob URL from the event is needed here; the video itself is fetched later, by name.
+    logger.info("🚀 Event Grid trigger received %s for %s", event.event_type, event.subject)
 
-    blob_name = blob.name.split("/")[-1] if blob.name else "unknown"
-    file_ext = os.path.splitext(blob_name)[1].lower()
-    logger.info(f"File extension: {file_ext}")
+    blob_url = (event.get_json() or {}).get("url", "")
+    container, _, blob_path = unquote(urlparse(blob_url).path).lstrip("/").partition("/")
 
-    if file_ext not in VIDEO_EXTENSIONS:
-        logger.warning(f"⛔ Skipping non-video file: {blob_name}")
+    if container != CONTAINER_NAME:
+        logger.warning("⛔ Skipping blob outside the %s container: %s", CONTAINER_NAME, blob_url)
         return
 
-    # Download the blob to a temporary file
-    logger.info(f"📥 Downloading blob: {blob_name}")
-    blob_client = BlobServiceClient(
-        account_url=f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-        credential=_credential
-    ).get_blob_client(container=CONTAINER_NAME, blob=blob_name)
-    
-    # Create temp file path
-    import tempfile
-    temp_dir = tempfile.gettempdir()
-    temp_file_path = os.path.join(temp_dir, blob_name)
-    
-    # Download blob to temp file
-    with open(temp_file_path, "wb") as temp_file:
-        download_stream = blob_client.download_blob()
-        temp_file.write(download_stream.readall())
-    
-    logger.info(f"✅ Downloaded blob to: {temp_file_path}")
+    # Queue the full path within the container; the SAS must be signed for it, not just the file name
+    if not blob_path.lower().endswith(VIDEO_EXTENSIONS):
+        logger.warning("⛔ Skipping non-video file: %s", blob_path)
+        return
 
-    # create Video Indexer Client
-    client = VideoIndexerClient()
+    msg.set(blob_path)
+    logger.info("📨 Queued video for indexing: %s", blob_path)
 
-    # Get access tokens (arm and Video Indexer account)
-    client.authenticate(consts_config)
-    client.get_account()
+
+# The host pulls queue messages in batches (see host.json) and runs them concurrently on this worker,
+# so a burst of uploads shares the cached tokens, delegation key and clients.
+@app.queue_trigger(arg_name="msg", queue_name=VIDEO_QUEUE_NAME, connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="indexed", queue_name=INDEXED_QUEUE_NAME, connection="AzureWebJobsStorage")
+async def index_video_blob(msg: func.QueueMessage, indexed: func.Out[str]):
+    """Send a queued video to Video Indexer and queue its video ID for publish_video_insights."""
+    _ensure_default_executor()
+    blob_name = msg.get_body().decode("utf-8")
+    # Video Indexer only needs a display name; the blob itself is addressed by its full path
+    video_name = blob_name.rpartition("/")[2]
+    logger.info("🎬 Processing queued video: %s", blob_name)
+
+    # The SAS generation and the Video Indexer authentication are independent, so run them concurrently.
+    # VideoIndexerClient is blocking, so it runs in a worker thread to keep the event loop free for other invocations.
+    sas_url, client = await asyncio.gather(
+        get_blob_sas_url(blob_name),
+        asyncio.to_thread(_get_video_indexer_client),
+    )
 
     ExcludedAI = []
     
-    # Upload the file directly instead of using URL
-    logger.info(f"📤 Uploading file to Video Indexer: {blob_name}")
-    video_id = client.file_upload(temp_file_path, blob_name, ExcludedAI)
-    
-    # Clean up temp file
-    os.remove(temp_file_path)
-    logger.info(f"🧹 Cleaned up temp file: {temp_file_path}")
+    # Let Video Indexer pull the video from storage via the SAS URL; the bytes never pass through the function
+    logger.info("📤 Submitting video URL to Video Indexer: %s", blob_name)
+    video_id = await asyncio.to_thread(client.upload_url, video_name, sas_url, ExcludedAI)
 
-    logger.info(f"🎉 Video uploaded successfully. Video ID: {video_id}.")
-    logger.info("⏳ Waiting for Video Indexer to process the video...")
-    result = client.wait_for_index(video_id)
+    # Every upload_url call starts a new (billed) indexing job, so nothing after it runs in this invocation.
+    # Waiting for the index and the search upload happen in the next stage, whose retries reuse this video ID.
+    indexed.set(json.dumps({"videoId": video_id, "blobName": blob_name}))
+    logger.info("🎉 Video uploaded successfully. Video ID: %s.", video_id)
 
-    if result:
-        logger.info("🎉 Video processing completed successfully.")
-        
-        # Get the video insights
-        insights = client.get_video(video_id)
-        
-        # Upload to Azure AI Search
-        upload_to_search_index(insights)
-    else:
+
+@app.queue_trigger(arg_name="msg", queue_name=INDEXED_QUEUE_NAME, connection="AzureWebJobsStorage")
+async def publish_video_insights(msg: func.QueueMessage):
+    """Wait for Video Indexer to finish a submitted video and push its insights to the search index."""
+    _ensure_default_executor()
+    message = json.loads(msg.get_body())
+    video_id = message["videoId"]
+    logger.info("⏳ Waiting for Video Indexer to process video %s (%s)...", video_id, message.get("blobName"))
+
+    client = await asyncio.to_thread(_get_video_indexer_client)
+    # wait_for_index returns the processed index itself, so there is no need to GET it again
+    insights = await client.wait_for_index_async(video_id)
+
+    if not insights:
         logger.error("🤔 Video processing failed.")
         return
-    
-    # Now that we have the results of the video processing, we can add it to the search index.
+
+    logger.info("🎉 Video processing completed successfully.")
+
+    # The schema check only matters for the search upload, so a failure here must not stop the upload
+    # from being attempted; it is retried by the next invocation.
+    try:
+        await _ensure_search_index()
+    except Exception as e:
+        logger.exception("❌ Error applying the search index schema: %s", e)
+
+    # Upload to Azure AI Search; a failure raises, so this message (not the submission) is retried
+    await upload_to_search_index(insights)
@@ -0,0 +1,48 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# (connect, read) timeout in seconds for every call made through the shared sessions
+DEFAULT_TIMEOUT = (5, 60)
+
+
+def _build_session(retry: Retry) -> requests.Session:
+    '''
+    Build a Session that keeps TCP/TLS connections alive between calls and retries with the given policy.
+
+    :param retry: The urllib3 retry policy mounted on the https adapter
+    :return: A configured requests Session
+    '''
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=retry))
+    return session
+
+
+# Shared by the Video Indexer and ARM calls: retries timeouts (408), throttling (429) and transient 5xx
+# responses with jittered exponential backoff. POST is included for the access token endpoint, which is
+# safe to repeat.
+session = _build_session(Retry(
+    total=5,
+    backoff_factor=1.0,
+    backoff_jitter=0.25,  # spread out retries from concurrent invocations
+    status_forcelist=(408, 429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["HEAD", "GET", "POST"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,  # hand the last response back so callers can raise_for_status()
+))
+
+# Used for the video upload POSTs, which start a billed indexing job. After a read timeout or a 5xx,
+# Video Indexer may already have accepted the job, so only retry when the request was never sent
+# (connect errors) or was explicitly rejected (429).
+upload_session = _build_session(Retry(
+    total=5,
+    connect=5,
+    read=0,
+    other=0,
+    backoff_factor=1.0,
+    backoff_jitter=0.25,
+    status_forcelist=(429,),
+    allowed_methods=frozenset(["POST"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+))